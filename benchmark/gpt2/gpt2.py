@@ -1,3 +1,4 @@
+import inspect
 import math
 from functools import partial
 from typing import Callable
@@ -440,6 +441,7 @@ def build_data(args):
         collate_fn=partial(_tokenize, tokenizer=tokenizer, seq_length=args.seq_length),
         num_workers=4,
         pin_memory=True,
+        persistent_workers=True,
     )
     test_data = get_dataloader(
         dataset=dataset["test"],
@@ -447,6 +449,7 @@ def build_data(args):
         collate_fn=partial(_tokenize, tokenizer=tokenizer, seq_length=args.seq_length),
         num_workers=4,
         pin_memory=True,
+        persistent_workers=True,
     )
     logger.info("Train and test data are built.")
 
@@ -463,7 +466,14 @@ def build_criterion():
 
 def build_optimizer(args, params):
     logger = get_logger()
-    optimizer = torch.optim.AdamW(params, lr=args.learning_rate, weight_decay=args.weight_decay)
+    kwargs = dict(lr=args.learning_rate, weight_decay=args.weight_decay)
+    # update all parameters of a group with fused or multi-tensor kernels instead of one launch per tensor
+    optim_params = inspect.signature(torch.optim.AdamW).parameters
+    if torch.cuda.is_available() and "fused" in optim_params:
+        kwargs["fused"] = True
+    elif "foreach" in optim_params:
+        kwargs["foreach"] = True
+    optimizer = torch.optim.AdamW(params, **kwargs)
     logger.info("Optimizer is built.")
     return optimizer
 
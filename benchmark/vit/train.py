@@ -1,5 +1,5 @@
 import argparse
-import time
+import inspect
 
 import cubework
 import torch
@@ -8,6 +8,7 @@ from cubework.distributed.collective import all_reduce
 from cubework.utils import (
     CommProfiler,
     MemoryTracker,
+    PrefetchIterator,
     calc_model_size,
     calc_tflops,
     clip_grad_norm,
@@ -27,6 +28,11 @@ _builder = {
     "vit": build_vit,
 }
 
+_amp_dtype = {
+    "fp16": torch.float16,
+    "bf16": torch.bfloat16,
+}
+
 mem_tracker = None
 comm_profiler = None
 
@@ -38,31 +44,66 @@ metric = None
 optimizer = None
 scaler = None
 lr_scheduler = None
+parameters = None
 
 numel = None
 
-
-def _data_parallel_sum(tensor):
-    out = tensor
-    if pm.DATA.world_size > 1:
-        out = all_reduce(out, pm.DATA)
-    return out
+accumulators = None
 
 
-def _data_parallel_mean(tensor):
-    out = tensor
-    if pm.DATA.world_size > 1:
-        out = all_reduce(out, pm.DATA) / pm.DATA.world_size
-    return out
+def aggregate_ddp_results(*vals):
+    tensor = torch.stack([val.to(torch.double) for val in vals])
+    tensor = all_reduce(tensor, pm.DATA)
+    return tuple(tensor.tolist())
 
 
-def _move_to_cuda(x):
-    if isinstance(x, dict):
-        return {k: _move_to_cuda(v) for k, v in x.items()}
-    elif isinstance(x, (tuple, list)):
-        return type(x)(_move_to_cuda(v) for v in x)
+def _get_accumulators(args):
+    # allocated once and zeroed in place at the start of every epoch
+    global accumulators
+    if accumulators is None:
+        device = get_current_device()
+        accumulators = (
+            torch.zeros((), dtype=torch.float, device=device),
+            torch.zeros((), dtype=torch.int, device=device),
+            torch.zeros((), dtype=torch.int, device=device),
+            torch.zeros(args.log_interval, dtype=torch.float, device=device),
+        )
     else:
-        return x.to(get_current_device())
+        for acc in accumulators:
+            acc.zero_()
+    return accumulators
+
+
+def _elapsed_time(step_events):
+    fwd_time = sum(start.elapsed_time(mid) for start, mid, _ in step_events) / 1000
+    bwd_time = sum(mid.elapsed_time(end) for _, mid, end in step_events) / 1000
+    return fwd_time, bwd_time
+
+
+def _capture_cuda_graph(args):
+    """Replaces the forward and backward pass of the model with CUDA graphs captured on a training batch.
+    Optimizer step, gradient clipping and the loss stay eager. Batch shapes must not change across steps.
+    """
+    assert not pm.TENSOR.is_initialized(), "CUDA graphs do not support the async gradient ops of tensor parallelism."
+    assert scaler is None, "CUDA graphs cannot capture dynamic loss scaling, use --amp_dtype bf16 instead."
+    assert not args.use_compile, "--use_cuda_graph and --use_compile are mutually exclusive."
+    assert not args.use_activation_checkpoint, "Activation checkpointing cannot be captured in CUDA graphs."
+    assert args.gradient_accumulation == 1, "CUDA graphs are captured for one micro-batch per step."
+
+    module = model.module if isinstance(model, DDP) else model
+    batch = next(PrefetchIterator(train_data))
+    batch.pop("labels")
+    # graphed callables only take positional tensors
+    keys = [k for k in inspect.signature(module.forward).parameters if k in batch]
+    sample_args = tuple(batch[k] for k in keys)
+
+    with torch.cuda.amp.autocast(
+        enabled=args.use_mixed_precision, dtype=_amp_dtype[args.amp_dtype], cache_enabled=False
+    ):
+        torch.cuda.make_graphed_callables(module, sample_args)
+
+    graphed_forward = module.forward
+    module.forward = lambda **kwargs: graphed_forward(*(kwargs[k] for k in keys))
 
 
 def _train(epoch, args):
@@ -78,13 +119,13 @@ def _train(epoch, args):
     if pm.GLOBAL.rank == 0:
         progress = tqdm(progress, desc=f"[Epoch {epoch} / Train]")
 
-    total_loss = torch.zeros(()).to(torch.float).to(get_current_device())
+    total_loss, total_samples, total_tokens, window_loss = _get_accumulators(args)
     total_time = 0.0
     total_steps = 0
-    total_samples = torch.zeros(()).to(torch.int).to(get_current_device())
-    total_tokens = torch.zeros(()).to(torch.int).to(get_current_device())
+    step_events = []
 
-    data_iter = iter(train_data)
+    # the first batch is fetched here, before the profilers start, so worker start-up is not measured
+    data_iter = PrefetchIterator(train_data)
 
     if comm_profiler is not None:
         comm_profiler.reset()
@@ -94,14 +135,18 @@ def _train(epoch, args):
         mem_tracker.start()
 
     for i in progress:
-        fwd_start = time.time()
+        fwd_start = torch.cuda.Event(enable_timing=True)
+        fwd_end = torch.cuda.Event(enable_timing=True)
+        bwd_end = torch.cuda.Event(enable_timing=True)
+
+        fwd_start.record()
 
-        batch = _move_to_cuda(next(data_iter))
+        batch = next(data_iter)
 
         labels = batch.pop("labels")
 
         if args.use_mixed_precision:
-            with torch.cuda.amp.autocast():
+            with torch.cuda.amp.autocast(dtype=_amp_dtype[args.amp_dtype], cache_enabled=not args.use_cuda_graph):
                 outputs = model(**batch)
         else:
             outputs = model(**batch)
@@ -110,24 +155,28 @@ def _train(epoch, args):
         batch_tokens = outputs.size(0) * outputs.size(1)
 
         loss = criterion(outputs, labels)
-        total_loss += loss
+        total_loss += loss.detach()
+        window_loss[i % args.log_interval] = loss.detach()
 
-        fwd_end = time.time()
+        fwd_end.record()
 
-        bwd_start = time.time()
+        if args.gradient_accumulation > 1:
+            scaled_loss = loss / args.gradient_accumulation
+        else:
+            scaled_loss = loss
 
         if scaler is not None:
-            scaler.scale(loss).backward()
+            scaler.scale(scaled_loss).backward()
         else:
-            loss.backward()
+            scaled_loss.backward()
 
-        synchronize()
+        synchronize(parameters)
 
-        if (i + 1) % args.gradient_accumulation or i + 1 == num_steps:
+        if (i + 1) % args.gradient_accumulation == 0 or i + 1 == num_steps:
             if scaler is not None:
                 if args.gradient_clipping > 0:
                     scaler.unscale_(optimizer)
-                    clip_grad_norm(model.parameters(), args.gradient_clipping)
+                    clip_grad_norm(parameters, args.gradient_clipping)
                 scaler.step(optimizer)
                 scale = scaler.get_scale()
                 scaler.update()
@@ -136,37 +185,45 @@ def _train(epoch, args):
                     lr_scheduler.step()
             else:
                 if args.gradient_clipping > 0:
-                    clip_grad_norm(model.parameters(), args.gradient_clipping)
+                    clip_grad_norm(parameters, args.gradient_clipping)
                 optimizer.step()
                 lr_scheduler.step()
+            optimizer.zero_grad(set_to_none=True)
 
-        bwd_end = time.time()
+        bwd_end.record()
+        step_events.append((fwd_start, fwd_end, bwd_end))
 
         total_steps += 1
         total_samples += batch_size
         total_tokens += batch_tokens
 
-        fwd_time = fwd_end - fwd_start
-        bwd_time = bwd_end - bwd_start
-        batch_time = fwd_time + bwd_time
-        total_time += batch_time
-
-        if pm.GLOBAL.rank == 0:
-            batch_tflops = calc_tflops(
-                numel,
-                batch_tokens * pm.DATA.world_size,
-                batch_time,
-                with_backward=True,
-                checkpoint=args.use_activation_checkpoint,
-            )
-            progress.set_postfix(
-                loss=loss.item(),
-                lr=lr_scheduler.get_last_lr()[0],
-                time_forward=fwd_time,
-                time_backward=bwd_time,
-                throughput=batch_size * pm.DATA.world_size / batch_time,
-                tflops=batch_tflops,
-            )
+        if (i + 1) % args.log_interval == 0 or i + 1 == num_steps:
+            window_steps = len(step_events)
+
+            # timings are only read at logging boundaries so that the host does not wait on every step
+            bwd_end.synchronize()
+            fwd_time, bwd_time = _elapsed_time(step_events)
+            window_time = fwd_time + bwd_time
+            total_time += window_time
+            step_events = []
+
+            if pm.GLOBAL.rank == 0:
+                batch_tflops = calc_tflops(
+                    numel,
+                    batch_tokens * window_steps * pm.DATA.world_size,
+                    window_time,
+                    with_backward=True,
+                    checkpoint=args.use_activation_checkpoint,
+                )
+                progress.set_postfix(
+                    # local loss of rank 0, reducing it would add collectives to the profiled region
+                    loss=window_loss[:window_steps].mean().item(),
+                    lr=lr_scheduler.get_last_lr()[0],
+                    time_forward=fwd_time / window_steps,
+                    time_backward=bwd_time / window_steps,
+                    throughput=batch_size * window_steps * pm.DATA.world_size / window_time,
+                    tflops=batch_tflops,
+                )
 
     torch.cuda.synchronize()
 
@@ -176,15 +233,14 @@ def _train(epoch, args):
     if comm_profiler is not None:
         comm_cnt, comm_vol, comm_time = comm_profiler.stop()
 
-    total_loss = _data_parallel_mean(total_loss)
-    total_samples = _data_parallel_sum(total_samples)
-    total_tokens = _data_parallel_sum(total_tokens)
+    total_loss, total_samples, total_tokens = aggregate_ddp_results(total_loss, total_samples, total_tokens)
+    total_loss /= pm.DATA.world_size
 
-    msg = f"[Epoch {epoch} / Train]: Loss = {total_loss.item() / total_steps:.3f}"
+    msg = f"[Epoch {epoch} / Train]: Loss = {total_loss / total_steps:.3f}"
     msg += f" | Step time = {total_time / total_steps:.3f} s"
-    msg += f" | Throughput = {total_samples.item() / total_time:.3f} samples/sec"
+    msg += f" | Throughput = {total_samples / total_time:.3f} samples/sec"
     tflops = calc_tflops(
-        numel, total_tokens.item(), total_time, with_backward=True, checkpoint=args.use_activation_checkpoint
+        numel, total_tokens, total_time, with_backward=True, checkpoint=args.use_activation_checkpoint
     )
     msg += f" | TFLOPS = {tflops:.3f}"
     if mem_tracker is not None:
@@ -213,14 +269,14 @@ def _test(epoch, args):
     if pm.GLOBAL.rank == 0:
         progress = tqdm(progress, desc=f"[Epoch {epoch} / Test]")
 
-    total_loss = torch.zeros(()).to(torch.float).to(get_current_device())
+    total_loss, total_samples, total_tokens, window_loss = _get_accumulators(args)
     total_time = 0.0
     total_steps = 0
-    total_samples = torch.zeros(()).to(torch.int).to(get_current_device())
-    total_tokens = torch.zeros(()).to(torch.int).to(get_current_device())
+    step_events = []
     metric.reset()
 
-    data_iter = iter(test_data)
+    # the first batch is fetched here, before the profilers start, so worker start-up is not measured
+    data_iter = PrefetchIterator(test_data)
 
     if comm_profiler is not None:
         comm_profiler.reset()
@@ -230,15 +286,18 @@ def _test(epoch, args):
         mem_tracker.start()
 
     with torch.no_grad():
-        for _ in progress:
-            batch_start = time.time()
+        for i in progress:
+            batch_start = torch.cuda.Event(enable_timing=True)
+            batch_end = torch.cuda.Event(enable_timing=True)
+
+            batch_start.record()
 
-            batch = _move_to_cuda(next(data_iter))
+            batch = next(data_iter)
 
             labels = batch.pop("labels")
 
             if args.use_mixed_precision:
-                with torch.cuda.amp.autocast():
+                with torch.cuda.amp.autocast(dtype=_amp_dtype[args.amp_dtype], cache_enabled=not args.use_cuda_graph):
                     outputs = model(**batch)
             else:
                 outputs = model(**batch)
@@ -249,32 +308,38 @@ def _test(epoch, args):
             loss = criterion(outputs, labels)
             eval_res = metric(outputs, labels, loss)
             total_loss += loss
+            window_loss[i % args.log_interval] = loss
 
-            batch_end = time.time()
+            batch_end.record()
+            step_events.append((batch_start, batch_end))
 
             total_steps += 1
             total_samples += batch_size
             total_tokens += batch_tokens
 
-            batch_time = batch_end - batch_start
-            total_time += batch_time
-
-            if pm.GLOBAL.rank == 0:
-                batch_tflops = calc_tflops(
-                    numel,
-                    batch_tokens * pm.DATA.world_size,
-                    batch_time,
-                    with_backward=False,
-                    checkpoint=False,
-                )
-                metrics = dict(
-                    loss=loss.item(),
-                    step_time=batch_time,
-                    throughput=batch_size * pm.DATA.world_size / batch_time,
-                    tflops=batch_tflops,
-                )
-                metrics[metric.name.lower()] = eval_res.item()
-                progress.set_postfix(**metrics)
+            if (i + 1) % args.log_interval == 0 or i + 1 == num_steps:
+                batch_end.synchronize()
+                window_time = sum(start.elapsed_time(end) for start, end in step_events) / 1000
+                window_steps = len(step_events)
+                total_time += window_time
+                step_events = []
+
+                if pm.GLOBAL.rank == 0:
+                    batch_tflops = calc_tflops(
+                        numel,
+                        batch_tokens * window_steps * pm.DATA.world_size,
+                        window_time,
+                        with_backward=False,
+                        checkpoint=False,
+                    )
+                    metrics = dict(
+                        loss=window_loss[:window_steps].mean().item(),
+                        step_time=window_time / window_steps,
+                        throughput=batch_size * window_steps * pm.DATA.world_size / window_time,
+                        tflops=batch_tflops,
+                    )
+                    metrics[metric.name.lower()] = eval_res.item()
+                    progress.set_postfix(**metrics)
 
     torch.cuda.synchronize()
 
@@ -284,17 +349,17 @@ def _test(epoch, args):
     if comm_profiler is not None:
         _, comm_vol, comm_time = comm_profiler.stop()
 
-    total_loss = _data_parallel_mean(total_loss)
-    total_samples = _data_parallel_sum(total_samples)
-    total_tokens = _data_parallel_sum(total_tokens)
+    total_loss, total_samples, total_tokens, *metric_values = aggregate_ddp_results(
+        total_loss, total_samples, total_tokens, *metric.values_to_reduce()
+    )
+    total_loss /= pm.DATA.world_size
+    metric_value = metric.value_from_reduced(*metric_values)
 
-    msg = f"[Epoch {epoch} / Test]: Loss = {total_loss.item() / total_steps:.3f}"
-    msg += f" | {metric.name} = {metric.to_str()}"
+    msg = f"[Epoch {epoch} / Test]: Loss = {total_loss / total_steps:.3f}"
+    msg += f" | {metric.name} = {metric.to_str(metric_value)}"
     msg += f" | Step time = {total_time / total_steps:.3f} s"
-    msg += f" | Throughput = {total_samples.item() / total_time:.3f} samples/sec"
-    tflops = calc_tflops(
-        numel, total_tokens.item(), total_time, with_backward=True, checkpoint=args.use_activation_checkpoint
-    )
+    msg += f" | Throughput = {total_samples / total_time:.3f} samples/sec"
+    tflops = calc_tflops(numel, total_tokens, total_time, with_backward=False, checkpoint=False)
     msg += f" | TFLOPS = {tflops:.3f}"
 
     if mem_tracker is not None:
@@ -330,12 +395,15 @@ def get_parser():
     parser.add_argument("--validation_interval", "--n_eval", type=int, default=1)
 
     parser.add_argument("--use_activation_checkpoint", "--ckpt", action="store_true", default=False)
+    parser.add_argument("--use_compile", "--compile", action="store_true", default=False)
+    parser.add_argument("--use_cuda_graph", "--graph", action="store_true", default=False)
 
     parser.add_argument("--gradient_clipping", "--clip", type=float, default=0.0)
 
     parser.add_argument("--gradient_accumulation", "--ac", type=int, default=1)
 
     parser.add_argument("--use_mixed_precision", "--amp", action="store_true", default=False)
+    parser.add_argument("--amp_dtype", type=str, choices=list(_amp_dtype.keys()), default="fp16")
     parser.add_argument("--fp16_initial_scale", type=float, default=2**15)
     parser.add_argument("--fp16_growth_factor", type=float, default=2.0)
     parser.add_argument("--fp16_backoff_factor", type=float, default=0.5)
@@ -344,7 +412,11 @@ def get_parser():
     parser.add_argument("--use_memory_tracker", "--prof_mem", action="store_true", default=False)
     parser.add_argument("--use_communication_profiler", "--prof_comm", action="store_true", default=False)
 
+    parser.add_argument("--log_interval", "--n_log", type=int, default=10)
     parser.add_argument("--log_file", type=str)
+
+    # library options that are off by default in cubework but wanted for benchmarking
+    parser.set_defaults(allow_tf32=True, cudnn_benchmark=True)
     return parser
 
 
@@ -365,8 +437,18 @@ def train():
 
     model = DDP(model, process_group=pm.DATA.group)
 
+    if args.use_compile:
+        # fuse the elementwise ops of the forward pass and the loss; compiled code follows the active autocast
+        model = torch.compile(model)
+        criterion = torch.compile(criterion)
+
+    # trainable parameters are collected once instead of walking the module tree every step
+    global parameters
+    parameters = [p for p in model.parameters() if p.requires_grad]
+
     global scaler
-    if args.use_mixed_precision:
+    # bf16 has the exponent range of fp32, so loss scaling is only needed for fp16
+    if args.use_mixed_precision and args.amp_dtype == "fp16":
         scaler = torch.cuda.amp.GradScaler(
             enabled=True,
             init_scale=args.fp16_initial_scale,
@@ -392,6 +474,15 @@ def train():
     model_mem = torch.cuda.max_memory_allocated(get_current_device())
     logger.info(f"Parameter size = {msg} | Model memory = {model_mem / 1024**3:.3f} GB.")
 
+    graph_mem = 0
+    if args.use_cuda_graph:
+        # static inputs, outputs and saved tensors of the graphs, reported apart from gradients and optimizer states
+        graph_mem = torch.cuda.memory_allocated(get_current_device())
+        _capture_cuda_graph(args)
+        graph_mem = torch.cuda.memory_allocated(get_current_device()) - graph_mem
+        logger.info("Forward and backward passes are captured in CUDA graphs.")
+        logger.info(f"CUDA graph memory = {graph_mem / 1024**3:.3f} GB.")
+
     logger.info("Benchmark start.")
 
     for epoch in range(args.num_epochs):
@@ -400,7 +491,7 @@ def train():
             if (epoch + 1) % args.validation_interval == 0 or epoch + 1 == args.num_epochs:
                 _test(epoch, args)
 
-    state_mem = torch.cuda.memory_allocated(get_current_device()) - model_mem
+    state_mem = torch.cuda.memory_allocated(get_current_device()) - model_mem - graph_mem
     logger.info(f"Gradients & optimizer states memory = {state_mem / 1024**3:.3f} GB.")
 
     logger.info("Benchmark complete.")
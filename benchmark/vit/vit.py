@@ -1,3 +1,4 @@
+import inspect
 import math
 from functools import partial
 from typing import Callable
@@ -397,6 +398,7 @@ def _mixup_data(features, transform, alpha=0.0, train=True):
         index = torch.randperm(batch_size)
 
         mixed_x = lam * x + (1 - lam) * x[index, :]
+        mixed_x = mixed_x.contiguous(memory_format=torch.channels_last)
         y_a, y_b = y, y[index]
         lam = torch.tensor(lam).to(mixed_x.dtype)
 
@@ -411,7 +413,7 @@ def _mixup_data(features, transform, alpha=0.0, train=True):
 
     else:
         return {
-            "pixel_values": x,
+            "pixel_values": x.contiguous(memory_format=torch.channels_last),
             "labels": {
                 "y_a": y,
                 "y_b": y,
@@ -440,7 +442,9 @@ class MixupAccuracy(cube_nn.Accuracy):
 
 def build_model(args):
     model_func = globals()[args.model_name]
-    return model_func(checkpoint=args.use_activation_checkpoint)
+    model = model_func(checkpoint=args.use_activation_checkpoint)
+    # NHWC layout lets the patch embedding convolution use tensor-core kernels
+    return model.to(memory_format=torch.channels_last)
 
 
 def build_data(args):
@@ -465,15 +469,17 @@ def build_data(args):
         batch_size=args.batch_size,
         drop_last=True,
         collate_fn=partial(_mixup_data, transform=transform_train, alpha=0.8, train=True),
-        num_workers=1,
+        num_workers=2,
         pin_memory=True,
+        persistent_workers=True,
     )
     test_data = get_dataloader(
         dataset=test_dataset,
         batch_size=args.batch_size,
         collate_fn=partial(_mixup_data, transform=transform_test, alpha=0.8, train=False),
-        num_workers=1,
+        num_workers=2,
         pin_memory=True,
+        persistent_workers=True,
     )
     return train_data, test_data
 
@@ -483,7 +489,14 @@ def build_criterion():
 
 
 def build_optimizer(args, params):
-    optimizer = torch.optim.AdamW(params, lr=args.learning_rate, weight_decay=args.weight_decay)
+    kwargs = dict(lr=args.learning_rate, weight_decay=args.weight_decay)
+    # update all parameters of a group with fused or multi-tensor kernels instead of one launch per tensor
+    optim_params = inspect.signature(torch.optim.AdamW).parameters
+    if torch.cuda.is_available() and "fused" in optim_params:
+        kwargs["fused"] = True
+    elif "foreach" in optim_params:
+        kwargs["foreach"] = True
+    optimizer = torch.optim.AdamW(params, **kwargs)
     return optimizer
 
 
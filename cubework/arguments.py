@@ -14,7 +14,13 @@ def parse_args(parser=None):
     parser.add_argument("--tensor_parallel", "--tp", type=str)
     parser.add_argument("--tensor_parallel_size", "--tp_size", type=int)
     parser.add_argument("--backend", type=str, default="nccl")
+    parser.add_argument("--nccl_nsocks_perthread", type=int)
+    parser.add_argument("--nccl_socket_nthreads", type=int)
     parser.add_argument("--seed", type=int)
+    parser.add_argument("--allow_tf32", action="store_true")
+    parser.add_argument("--no_tf32", dest="allow_tf32", action="store_false")
+    parser.add_argument("--cudnn_benchmark", action="store_true")
+    parser.add_argument("--no_cudnn_benchmark", dest="cudnn_benchmark", action="store_false")
 
     global _ARGS
     _ARGS = parser.parse_args()
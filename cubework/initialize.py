@@ -1,5 +1,6 @@
 import os
 
+import torch
 import torch.distributed as dist
 
 import cubework.distributed as cube_dist
@@ -32,6 +33,12 @@ def initialize_distributed(parser=None):
 
     init_method = f"tcp://{addr}:{port}"
     backend = "nccl" if args.backend is None else args.backend
+    if backend == "nccl":
+        # socket transport tuning is opt-in, NCCL picks its own values otherwise
+        if args.nccl_nsocks_perthread is not None:
+            os.environ["NCCL_NSOCKS_PERTHREAD"] = str(args.nccl_nsocks_perthread)
+        if args.nccl_socket_nthreads is not None:
+            os.environ["NCCL_SOCKET_NTHREADS"] = str(args.nccl_socket_nthreads)
     dist.init_process_group(rank=rank, world_size=world_size, backend=backend, init_method=init_method)
 
     init_logger()
@@ -40,6 +47,14 @@ def initialize_distributed(parser=None):
 
     set_device(local_rank)
 
+    if args.allow_tf32:
+        # use tensor cores for the remaining fp32 matmuls and convolutions
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.backends.cudnn.allow_tf32 = True
+    if args.cudnn_benchmark:
+        # with fixed input shapes the algorithm search of cuDNN only runs once per shape
+        torch.backends.cudnn.benchmark = True
+
     cube_dist.init_global()
 
     data_parallel_size = world_size if args.tensor_parallel_size is None else world_size // args.tensor_parallel_size
@@ -36,19 +36,32 @@ class Metric(nn.Module):
     def value(self):
         ...
 
+    @abstractmethod
+    def values_to_reduce(self):
+        """Returns the device tensors to sum over the data parallel group."""
+
+    @abstractmethod
+    def value_from_reduced(self, *reduced_values):
+        """Computes the metric from the summed results of `values_to_reduce()`, in the same order."""
+
 
 class Accuracy(Metric):
     def __init__(self):
         super().__init__("Accuracy")
         tensor_parallel = get_tensor_parallel_mode()
         self.acc = _parallel_accuracy[tensor_parallel]()
-        self.reset()
+        self.total_correct = torch.zeros((), dtype=torch.int, device=get_current_device())
+        self.total_samples = torch.zeros((), dtype=torch.int, device=get_current_device())
+        self._reduce_buf = torch.zeros(2, dtype=torch.int, device=get_current_device())
 
     def reset(self):
-        self.total_correct = torch.zeros(()).to(torch.int).to(get_current_device())
-        self.total_samples = torch.zeros(()).to(torch.int).to(get_current_device())
+        self.total_correct.zero_()
+        self.total_samples.zero_()
 
     def forward(self, logits, targets, loss):
+        # everything stays on device; `value()` is the only point that synchronizes with the host.
+        # `batch_size` is a Python int on purpose: it is passed to the add kernel as a scalar argument,
+        # whereas wrapping it in a device tensor would cost a host-to-device copy per batch.
         with torch.no_grad():
             batch_size = targets.size(0)
             correct = self.acc(logits, targets)
@@ -58,21 +71,32 @@ class Accuracy(Metric):
 
     def value(self):
         with torch.no_grad():
-            reduced_values = all_reduce(torch.stack([self.total_correct, self.total_samples]), pm.DATA)
-            return reduced_values[0] / reduced_values[1]
+            self._reduce_buf[0] = self.total_correct
+            self._reduce_buf[1] = self.total_samples
+            reduced_values = all_reduce(self._reduce_buf, pm.DATA)
+            return self.value_from_reduced(reduced_values[0], reduced_values[1])
+
+    def values_to_reduce(self):
+        return self.total_correct, self.total_samples
 
-    def to_str(self):
-        return f"{self.value().item()*100:.2f} %"
+    def value_from_reduced(self, correct, samples):
+        return torch.as_tensor(correct, dtype=torch.float) / samples
+
+    def to_str(self, value=None):
+        if value is None:
+            value = self.value()
+        return f"{float(value)*100:.2f} %"
 
 
 class Perplexity(Metric):
     def __init__(self):
         super().__init__("Perplexity")
-        self.reset()
+        self.cnt = 0
+        self.total_loss = torch.zeros((), dtype=torch.float, device=get_current_device())
 
     def reset(self):
         self.cnt = 0
-        self.total_loss = torch.zeros(()).to(torch.float).to(get_current_device())
+        self.total_loss.zero_()
 
     def forward(self, logits, targets, loss):
         with torch.no_grad():
@@ -82,8 +106,16 @@ class Perplexity(Metric):
 
     def value(self):
         with torch.no_grad():
-            reduced_loss = all_reduce(self.total_loss, pm.DATA) / (self.cnt * pm.DATA.world_size)
-            return torch.exp(reduced_loss)
+            return self.value_from_reduced(all_reduce(self.total_loss, pm.DATA))
+
+    def values_to_reduce(self):
+        return (self.total_loss,)
+
+    def value_from_reduced(self, total_loss):
+        mean_loss = torch.as_tensor(total_loss, dtype=torch.float) / (self.cnt * pm.DATA.world_size)
+        return torch.exp(mean_loss)
 
-    def to_str(self):
-        return f"{self.value().item():.5g}"
+    def to_str(self, value=None):
+        if value is None:
+            value = self.value()
+        return f"{float(value):.5g}"
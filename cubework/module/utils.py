@@ -52,7 +52,7 @@ class AsyncGradientBucket(object):
                     p.grad = grad
                 else:
                     p.grad.add_(grad)
-        torch.cuda.default_stream().synchronize()
+        # wait() already orders the current stream after the collectives, so the host does not block here
 
 
 _async_grad_bucket = AsyncGradientBucket()
@@ -1,5 +1,5 @@
 from .clip_grad import clip_grad_norm
 from .common import free_port, get_current_device, seed, set_device, set_seed
-from .data import get_dataloader
+from .data import PrefetchIterator, get_dataloader
 from .logging import get_logger, init_logger, write_logger_to_file
-from .profiling import CommProfiler, MemoryTracker, calc_model_size, calc_tflops
+from .profiling import CommProfiler, MemoryTracker, batch_wait, calc_model_size, calc_tflops
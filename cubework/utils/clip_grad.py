@@ -3,6 +3,7 @@ https://github.com/pytorch/pytorch/blob/master/torch/nn/utils/clip_grad.py
 and https://github.com/NVIDIA/Megatron-LM/blob/main/megatron/optimizer/clip_grads.py
 """
 
+from math import inf
 from typing import Iterable, Union
 
 import torch
@@ -10,7 +11,31 @@ from cubework.distributed import ParallelManager as pm
 from cubework.distributed import all_reduce
 from cubework.global_vars import NUM_PARTITIONS
 from torch import Tensor
-from torch._six import inf
+
+
+def _foreach_norm(tensors, norm_type):
+    if hasattr(torch, "_foreach_norm"):
+        return torch._foreach_norm(tensors, norm_type)
+    return [torch.norm(t, norm_type) for t in tensors]
+
+
+def _has_foreach_mul_tensor():
+    try:
+        return "Tensor" in torch.ops.aten._foreach_mul_.overloads()
+    except (AttributeError, RuntimeError):
+        return False
+
+
+_HAS_FOREACH_MUL_TENSOR = _has_foreach_mul_tensor()
+
+
+def _foreach_mul_(tensors, scalar):
+    if _HAS_FOREACH_MUL_TENSOR:
+        torch._foreach_mul_(tensors, scalar)
+    else:
+        # without the tensor overload a device tensor is read back as a Python scalar, which synchronizes
+        for t in tensors:
+            t.mul_(scalar)
 
 
 def clip_grad_norm(
@@ -27,27 +52,29 @@ def clip_grad_norm(
     if len(parameters) == 0:
         return torch.tensor(0.0)
     device = parameters[0].grad.device
+    grads = [p.grad.detach() for p in parameters]
     if norm_type == inf:
         norms = [p.grad.detach().abs().max().to(device) for p in parameters]
         total_norm = norms[0] if len(norms) == 1 else torch.max(torch.stack(norms))
         if pm.TENSOR.is_initialized() and pm.TENSOR.world_size > 1:
             total_norm = all_reduce(total_norm, pm.TENSOR, op=torch.distributed.ReduceOp.MAX)
     else:
+        # per-tensor norms come from a single fused kernel, then are combined per group with stacked ops
         std_norms = list()
-        tp_norms = list()
-        for p in parameters:
-            norm = torch.norm(p.grad.detach(), norm_type) ** norm_type
-            norm = norm.to(device)
+        tp_norms = dict()
+        for p, norm in zip(parameters, _foreach_norm(grads, norm_type)):
             num_partitions = getattr(p, NUM_PARTITIONS, 0)
             if num_partitions > 0:
-                tp_norms.append(norm * num_partitions)
+                tp_norms.setdefault(num_partitions, list()).append(norm)
             else:
                 std_norms.append(norm)
         std_norm = (
-            torch.sum(torch.stack(std_norms)) if len(std_norms) > 0 else torch.zeros(()).to(torch.float).to(device)
+            torch.sum(torch.stack(std_norms) ** norm_type)
+            if len(std_norms) > 0
+            else torch.zeros(()).to(torch.float).to(device)
         )
         if len(tp_norms) > 0:
-            tp_norm = torch.sum(torch.stack(tp_norms))
+            tp_norm = sum(torch.sum(torch.stack(norms) ** norm_type) * n for n, norms in tp_norms.items())
             tp_norm = all_reduce(tp_norm, pm.TENSOR) / pm.TENSOR.world_size
         else:
             tp_norm = torch.zeros(()).to(torch.float).to(device)
@@ -64,7 +91,6 @@ def clip_grad_norm(
     # avoids a `if clip_coef < 1:` conditional which can require a CPU <=> device synchronization
     # when the gradients do not reside in CPU memory.
     clip_coef_clamped = torch.clamp(clip_coef, max=1.0)
-    for p in parameters:
-        p.grad.detach().mul_(clip_coef_clamped.to(p.grad.device))
+    _foreach_mul_(grads, clip_coef_clamped.to(device))
 
     return total_norm
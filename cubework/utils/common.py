@@ -18,9 +18,14 @@ def seed(paralle_mode):
         torch.cuda.set_rng_state(cur_cuda_rng_state)
 
 
+_CURRENT_DEVICE = None
+
+
 def set_device(rank):
+    global _CURRENT_DEVICE
     if torch.cuda.is_available():
         torch.cuda.set_device(rank)
+        _CURRENT_DEVICE = torch.device("cuda", rank)
 
 
 def set_seed(seed):
@@ -30,7 +35,9 @@ def set_seed(seed):
 
 
 def get_current_device():
-    if torch.cuda.is_available():
+    if _CURRENT_DEVICE is not None:
+        return _CURRENT_DEVICE
+    elif torch.cuda.is_available():
         return torch.cuda.current_device()
     else:
         return torch.device("cpu")
@@ -1,10 +1,14 @@
 import random
+from collections.abc import Mapping
 
 import numpy as np
 import torch
 from cubework.distributed import ParallelManager as pm
+from torch.utils._pytree import tree_flatten, tree_map
 from torch.utils.data import DataLoader, DistributedSampler
 
+from .common import get_current_device
+
 
 def get_dataloader(dataset, batch_size, shuffle=False, seed=1024, **kwargs):
     world_size = pm.DATA.world_size
@@ -24,3 +28,61 @@ def get_dataloader(dataset, batch_size, shuffle=False, seed=1024, **kwargs):
         worker_init_fn=seed_worker,
         **kwargs
     )
+
+
+def _to_device_async(batch, device):
+    # dict-like containers returned by collators (e.g. BatchEncoding) are not pytree nodes
+    if isinstance(batch, Mapping):
+        batch = dict(batch)
+    return tree_map(lambda x: x.to(device, non_blocking=True) if torch.is_tensor(x) else x, batch)
+
+
+def _record_stream(batch, stream):
+    for x in tree_flatten(batch)[0]:
+        if torch.is_tensor(x) and x.is_cuda:
+            x.record_stream(stream)
+
+
+class PrefetchIterator(object):
+    """Iterates over a data loader and copies the next batch to device on a side stream,
+    so that host-to-device transfers overlap with the computation of the current batch.
+    Batches should come from pinned memory (``pin_memory=True``) for the copies to be asynchronous.
+    """
+
+    def __init__(self, loader, device=None):
+        self.device = get_current_device() if device is None else device
+        self.data_iter = iter(loader)
+        self.stream = torch.cuda.Stream() if torch.cuda.is_available() else None
+        self._preload()
+
+    def _preload(self):
+        try:
+            batch = next(self.data_iter)
+        except StopIteration:
+            self.next_batch = None
+            self.next_event = None
+            return
+
+        if self.stream is None:
+            self.next_batch = _to_device_async(batch, self.device)
+            self.next_event = None
+        else:
+            with torch.cuda.stream(self.stream):
+                self.next_batch = _to_device_async(batch, self.device)
+                self.next_event = torch.cuda.Event()
+                self.next_event.record(self.stream)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.next_batch is None:
+            raise StopIteration
+        batch, event = self.next_batch, self.next_event
+        if event is not None:
+            current_stream = torch.cuda.current_stream()
+            current_stream.wait_event(event)
+            # the batch was allocated on the side stream but is consumed on the current one
+            _record_stream(batch, current_stream)
+        self._preload()
+        return batch
@@ -1,3 +1,3 @@
-from .communication import CommProfiler
+from .communication import CommProfiler, batch_wait
 from .flops import calc_model_size, calc_tflops
 from .memory_tracker import MemoryTracker
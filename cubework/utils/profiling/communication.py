@@ -1,4 +1,4 @@
-from functools import partial
+from collections import deque
 from typing import List
 
 import torch
@@ -15,16 +15,16 @@ torch_reduce = dist.reduce
 
 class CommProfiler(object):
     def __init__(self):
-        self.start_event = torch.cuda.Event(enable_timing=True)
-        self.end_event = torch.cuda.Event(enable_timing=True)
+        self.event_pool = list()
         self.reset()
 
     def start(self):
-        dist.all_reduce = partial(all_reduce, profiler=self)
-        dist.all_gather = partial(all_gather, profiler=self)
-        dist.reduce_scatter = partial(reduce_scatter, profiler=self)
-        dist.broadcast = partial(broadcast, profiler=self)
-        dist.reduce = partial(reduce, profiler=self)
+        # bound methods are installed directly, so a profiled collective is a single Python call
+        dist.all_reduce = self.all_reduce
+        dist.all_gather = self.all_gather
+        dist.reduce_scatter = self.reduce_scatter
+        dist.broadcast = self.broadcast
+        dist.reduce = self.reduce
 
     def stop(self):
         dist.all_reduce = torch_all_reduce
@@ -33,32 +33,114 @@ class CommProfiler(object):
         dist.broadcast = torch_broadcast
         dist.reduce = torch_reduce
 
+        # pending intervals are only resolved here, so profiling does not add a synchronization to every collective
+        if len(self.events) > 0:
+            torch.cuda.synchronize()
+            self._collect(force=True)
+
         return self.total_count, self.total_volume, self.total_time / 1000
 
     def new(self, vol):
         self.running_ops += 1
         self.total_count += 1
         self.total_volume += vol
-        if not self.is_profiling:
-            self.is_profiling = True
-            self.start_event.record()
+        if self.start_event is None:
+            self.start_event = self._get_event()
+            self.start_event.record(torch.cuda.current_stream())
 
     def finish(self):
         self.running_ops -= 1
         if self.running_ops == 0:
-            self.end_event.record()
-            self.start_event.synchronize()
-            self.end_event.synchronize()
-            self.total_time += self.start_event.elapsed_time(self.end_event)
-            self.is_profiling = False
+            end_event = self._get_event()
+            end_event.record(torch.cuda.current_stream())
+            self.events.append((self.start_event, end_event))
+            self.start_event = None
+            self._collect()
 
     def reset(self):
-        assert self.start_event.query() and self.end_event.query(), "Existing profiling events are not completed yet."
         self.running_ops = 0
         self.total_time = 0.0
-        self.total_volume = 0.0
+        self.total_volume = 0
         self.total_count = 0
-        self.is_profiling = False
+        self.start_event = None
+        self.events = deque()
+
+    def _get_event(self):
+        if len(self.event_pool) > 0:
+            return self.event_pool.pop()
+        return torch.cuda.Event(enable_timing=True)
+
+    def _collect(self, force=False):
+        # folds completed intervals into the total time and recycles their events,
+        # so only the intervals still in flight keep events alive
+        while len(self.events) > 0:
+            start_event, end_event = self.events[0]
+            if not force and not (end_event.query() and start_event.query()):
+                break
+            self.total_time += start_event.elapsed_time(end_event)
+            self.events.popleft()
+            self.event_pool.append(start_event)
+            self.event_pool.append(end_event)
+
+    def all_reduce(self, tensor: Tensor, op: ReduceOp = ReduceOp.SUM, group=None, async_op: bool = False):
+        comm_size = dist.get_world_size(group)
+        comm_vol = 2 * (comm_size - 1) * tensor.nbytes // comm_size
+        self.new(comm_vol)
+        work = torch_all_reduce(tensor, op, group, async_op)
+
+        if async_op:
+            return CommHandler(self, work)
+        else:
+            self.finish()
+
+    def reduce_scatter(
+        self,
+        output: Tensor,
+        input_list: List[Tensor],
+        op: ReduceOp = ReduceOp.SUM,
+        group=None,
+        async_op: bool = False,
+    ):
+        comm_size = dist.get_world_size(group)
+        comm_vol = (comm_size - 1) * sum(tensor.nbytes for tensor in input_list) // comm_size
+        self.new(comm_vol)
+        work = torch_reduce_scatter(output, input_list, op, group, async_op)
+
+        if async_op:
+            return CommHandler(self, work)
+        else:
+            self.finish()
+
+    def all_gather(self, tensor_list: List[Tensor], tensor: Tensor, group=None, async_op: bool = False):
+        comm_size = dist.get_world_size(group)
+        comm_vol = (comm_size - 1) * sum(ten.nbytes for ten in tensor_list) // comm_size
+        self.new(comm_vol)
+        work = torch_all_gather(tensor_list, tensor, group, async_op)
+
+        if async_op:
+            return CommHandler(self, work)
+        else:
+            self.finish()
+
+    def broadcast(self, tensor: Tensor, src: int, group=None, async_op: bool = False):
+        comm_vol = tensor.nbytes
+        self.new(comm_vol)
+        work = torch_broadcast(tensor, src, group, async_op)
+
+        if async_op:
+            return CommHandler(self, work)
+        else:
+            self.finish()
+
+    def reduce(self, tensor: Tensor, dst: int, op: ReduceOp = ReduceOp.SUM, group=None, async_op: bool = False):
+        comm_vol = tensor.nbytes
+        self.new(comm_vol)
+        work = torch_reduce(tensor, dst, op, group, async_op)
+
+        if async_op:
+            return CommHandler(self, work)
+        else:
+            self.finish()
 
 
 class CommHandler(object):
@@ -72,90 +154,8 @@ class CommHandler(object):
         self.prof.finish()
 
 
-def all_reduce(
-    tensor: Tensor, op: ReduceOp = ReduceOp.SUM, group=None, async_op: bool = False, profiler: CommProfiler = None
-):
-    comm_size = dist.get_world_size(group)
-    correction = 2 * (comm_size - 1) / comm_size
-    comm_vol = correction * tensor.element_size() * tensor.numel()
-    profiler.new(comm_vol)
-    work = torch_all_reduce(tensor, op, group, async_op)
-
-    if async_op:
-        return CommHandler(profiler, work)
-    else:
-        profiler.finish()
-
-
-def reduce_scatter(
-    output: Tensor,
-    input_list: List[Tensor],
-    op: ReduceOp = ReduceOp.SUM,
-    group=None,
-    async_op: bool = False,
-    profiler: CommProfiler = None,
-):
-    comm_size = dist.get_world_size(group)
-    correction = (comm_size - 1) / comm_size
-    comm_vol = 0
-    for tensor in input_list:
-        comm_vol += tensor.element_size() * tensor.numel()
-    comm_vol *= correction
-    profiler.new(comm_vol)
-    work = torch_reduce_scatter(output, input_list, op, group, async_op)
-
-    if async_op:
-        return CommHandler(profiler, work)
-    else:
-        profiler.finish()
-
-
-def all_gather(
-    tensor_list: List[Tensor],
-    tensor: Tensor,
-    group=None,
-    async_op: bool = False,
-    profiler: CommProfiler = None,
-):
-    comm_size = dist.get_world_size(group)
-    correction = (comm_size - 1) / comm_size
-    comm_vol = 0
-    for ten in tensor_list:
-        comm_vol += ten.element_size() * ten.numel()
-    comm_vol *= correction
-    profiler.new(comm_vol)
-    work = torch_all_gather(tensor_list, tensor, group, async_op)
-
-    if async_op:
-        return CommHandler(profiler, work)
-    else:
-        profiler.finish()
-
-
-def broadcast(tensor: Tensor, src: int, group=None, async_op: bool = False, profiler: CommProfiler = None):
-    comm_vol = 1.0 * tensor.element_size() * tensor.numel()
-    profiler.new(comm_vol)
-    work = torch_broadcast(tensor, src, group, async_op)
-
-    if async_op:
-        return CommHandler(profiler, work)
-    else:
-        profiler.finish()
-
-
-def reduce(
-    tensor: Tensor,
-    dst: int,
-    op: ReduceOp = ReduceOp.SUM,
-    group=None,
-    async_op: bool = False,
-    profiler: CommProfiler = None,
-):
-    comm_vol = 1.0 * tensor.element_size() * tensor.numel()
-    profiler.new(comm_vol)
-    work = torch_reduce(tensor, dst, op, group, async_op)
-
-    if async_op:
-        return CommHandler(profiler, work)
-    else:
-        profiler.finish()
+def batch_wait(handlers):
+    # waits on a list of async handlers (CommHandler or Work), skipping ops that were never issued
+    for handler in handlers:
+        if handler is not None:
+            handler.wait()
@@ -0,0 +1,48 @@
+import math
+
+import pytest
+import torch
+import torch.nn.functional as F
+from cubework.distributed import ParallelManager as pm
+from cubework.module import Accuracy, Perplexity
+
+
+@pytest.fixture
+def single_rank(monkeypatch):
+    # a data parallel group of one rank, so the sum over the group is the local value
+    monkeypatch.setattr(pm.DATA, "_initialized", True)
+    monkeypatch.setattr(pm.DATA, "_world_size", 1)
+
+
+def run_metric(metric, num_steps=4):
+    torch.manual_seed(1024)
+    losses, num_correct, num_samples = list(), 0, 0
+    for _ in range(num_steps):
+        logits = torch.randn(8, 5)
+        targets = torch.randint(0, 5, (8,))
+        loss = F.cross_entropy(logits, targets)
+        metric(logits, targets, loss)
+        losses.append(loss.item())
+        num_correct += (logits.argmax(dim=-1) == targets).sum().item()
+        num_samples += targets.size(0)
+    return losses, num_correct, num_samples
+
+
+def test_accuracy(single_rank):
+    metric = Accuracy()
+    _, num_correct, num_samples = run_metric(metric)
+
+    reduced = metric.value_from_reduced(*metric.values_to_reduce())
+    value = metric.value()
+    assert torch.allclose(reduced, value)
+    assert math.isclose(float(value), num_correct / num_samples, rel_tol=1e-6)
+
+
+def test_perplexity(single_rank):
+    metric = Perplexity()
+    losses, _, _ = run_metric(metric)
+
+    reduced = metric.value_from_reduced(*metric.values_to_reduce())
+    value = metric.value()
+    assert torch.allclose(reduced, value)
+    assert math.isclose(float(value), math.exp(sum(losses) / len(losses)), rel_tol=1e-5)
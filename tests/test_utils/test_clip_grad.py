@@ -0,0 +1,64 @@
+from math import inf
+
+import pytest
+import torch
+from cubework.distributed import ParallelManager as pm
+from cubework.module.utils import set_tensor_parallel_attribute_by_partition
+from cubework.utils import clip_grad
+from cubework.utils import clip_grad_norm
+
+
+@pytest.fixture
+def single_rank(monkeypatch):
+    # a tensor parallel group of one rank, so all_reduce returns its input without a collective
+    monkeypatch.setattr(pm.TENSOR, "_initialized", True)
+    monkeypatch.setattr(pm.TENSOR, "_world_size", 1)
+
+
+def build_parameters(num_partitions):
+    torch.manual_seed(1024)
+    params = list()
+    for shape, partitions in zip([(16, 8), (8,), (4, 4, 2), (32,)], num_partitions):
+        p = torch.nn.Parameter(torch.randn(shape))
+        p.grad = torch.randn(shape) * 10
+        if partitions > 0:
+            set_tensor_parallel_attribute_by_partition(p, partitions)
+        params.append(p)
+    return params
+
+
+def reference_clip_grad_norm(grads, num_partitions, max_norm, norm_type):
+    if norm_type == inf:
+        total_norm = max(g.abs().max() for g in grads)
+    else:
+        total_norm = sum(
+            torch.norm(g, norm_type) ** norm_type * max(partitions, 1) for g, partitions in zip(grads, num_partitions)
+        )
+        total_norm = total_norm ** (1.0 / norm_type)
+    clip_coef = torch.clamp(max_norm / (total_norm + 1e-6), max=1.0)
+    return total_norm, [g * clip_coef for g in grads]
+
+
+def check_clip_grad_norm(num_partitions, max_norm, norm_type):
+    params = build_parameters(num_partitions)
+    grads = [p.grad.clone() for p in params]
+    ref_norm, ref_grads = reference_clip_grad_norm(grads, num_partitions, max_norm, norm_type)
+
+    total_norm = clip_grad_norm(params, max_norm, norm_type)
+
+    assert torch.allclose(total_norm, ref_norm, rtol=1e-5)
+    for p, ref_grad in zip(params, ref_grads):
+        assert torch.allclose(p.grad, ref_grad, rtol=1e-5)
+
+
+@pytest.mark.parametrize("norm_type", [1.0, 2.0, 3.0, inf])
+@pytest.mark.parametrize("num_partitions", [[0, 0, 0, 0], [2, 0, 4, 2]])
+@pytest.mark.parametrize("max_norm", [1.0, 1e6])
+def test_clip_grad_norm(single_rank, num_partitions, max_norm, norm_type):
+    check_clip_grad_norm(num_partitions, max_norm, norm_type)
+
+
+@pytest.mark.parametrize("norm_type", [2.0, inf])
+def test_clip_grad_norm_without_foreach_mul_tensor(single_rank, monkeypatch, norm_type):
+    monkeypatch.setattr(clip_grad, "_HAS_FOREACH_MUL_TENSOR", False)
+    check_clip_grad_norm([2, 0, 4, 2], 1.0, norm_type)
@@ -0,0 +1,68 @@
+from collections import UserDict
+
+import pytest
+import torch
+from cubework.utils import PrefetchIterator, get_current_device
+
+
+class CountingLoader(object):
+    def __init__(self, batches):
+        self.batches = batches
+        self.num_fetched = 0
+
+    def __iter__(self):
+        for batch in self.batches:
+            self.num_fetched += 1
+            yield batch
+
+
+def test_prefetch_nested_dict():
+    batches = [
+        {
+            "inputs": {"input_ids": torch.arange(8).view(2, 4), "attention_mask": torch.ones(2, 4)},
+            "labels": torch.tensor([i, i + 1]),
+        }
+        for i in range(3)
+    ]
+    outputs = list(PrefetchIterator(batches))
+
+    assert len(outputs) == len(batches)
+    for batch, output in zip(batches, outputs):
+        assert type(output) is dict and type(output["inputs"]) is dict
+        assert torch.equal(output["inputs"]["input_ids"], batch["inputs"]["input_ids"])
+        assert torch.equal(output["inputs"]["attention_mask"], batch["inputs"]["attention_mask"])
+        assert torch.equal(output["labels"], batch["labels"])
+        assert output["labels"].device.type == torch.device(get_current_device()).type
+
+
+def test_prefetch_user_dict():
+    # collators such as the ones in transformers return BatchEncoding, a UserDict subclass
+    batch = UserDict(input_ids=torch.arange(4), labels=torch.ones(4))
+    output = next(PrefetchIterator([batch]))
+
+    assert type(output) is dict
+    assert torch.equal(output["input_ids"], batch["input_ids"])
+    assert torch.equal(output["labels"], batch["labels"])
+
+
+def test_prefetch_stop_iteration():
+    data_iter = PrefetchIterator([torch.zeros(2), torch.ones(2)])
+    next(data_iter)
+    next(data_iter)
+    with pytest.raises(StopIteration):
+        next(data_iter)
+    with pytest.raises(StopIteration):
+        next(data_iter)
+
+    with pytest.raises(StopIteration):
+        next(PrefetchIterator([]))
+
+
+def test_prefetch_first_batch_in_constructor():
+    loader = CountingLoader([torch.full((2,), i) for i in range(3)])
+    data_iter = PrefetchIterator(loader)
+    assert loader.num_fetched == 1
+
+    # each step hands out the prefetched batch and fetches the one after it
+    assert torch.equal(next(data_iter), torch.full((2,), 0))
+    assert loader.num_fetched == 2